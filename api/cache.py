@@ -0,0 +1,53 @@
+import threading
+import time
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """Small thread-safe in-process cache whose entries expire after `ttl` seconds.
+
+    Each worker process keeps its own copy, so entries must be safe to serve
+    for up to `ttl` seconds after the underlying data changes elsewhere.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.maxsize:
+                # Evict the oldest entry
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Figures for closed months only change when expenses are back-dated or edited
+period_cache = TTLCache(ttl=3600)
+
+# Dashboards poll the same aggregates repeatedly; writes that change them clear it
+response_cache = TTLCache(ttl=120)
+
+# Branch product listings and low stock views; cleared by writes to branches,
+# branch products, products and batches
+branch_product_cache = TTLCache(ttl=60)
+
+# Every installed app polls the active version on startup; uploads clear it
+active_version_cache = TTLCache(ttl=30, maxsize=1)
@@ -1,6 +1,7 @@
 from typing import Annotated
 from sqlalchemy.orm import Session
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from jose import jwt, JWTError
@@ -24,7 +25,30 @@ def get_db():
 
 db_dependency = Annotated[Session, Depends(get_db)]
 
-bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+async def run_in_session(fn, *args):
+    """Run a blocking query function in the threadpool on its own session.
+
+    Each call checks out a separate connection, so independent queries can be
+    awaited together with asyncio.gather instead of running one after another.
+    """
+    def call():
+        db = SessionLocal()
+        try:
+            return fn(db, *args)
+        finally:
+            db.close()
+    return await run_in_threadpool(call)
+
+# New hashes use argon2id, which costs far less CPU per login than bcrypt at its
+# default rounds. Existing bcrypt hashes still verify and are upgraded on login.
+bcrypt_context = CryptContext(
+    schemes=['argon2', 'bcrypt'],
+    deprecated='auto',
+    argon2__type='ID',
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+    argon2__parallelism=1
+)
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl='auth/token')
 oauth2_bearer_dependency = Annotated[str, Depends(oauth2_bearer)]
 
@@ -40,20 +64,23 @@ async def get_current_user(token: oauth2_bearer_dependency):
         return {
             'username': username,
             'id': user_id,
-            'role': role,
+            # Parsed once here so handlers can compare against UserRole members directly
+            'role': UserRole(role),
             'branch_id': branch_id
         }
-    except JWTError:
+    except (JWTError, ValueError):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate user')
 
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
 def role_required(allowed_roles):
+    # Normalised once when the route is declared; each request is a single set lookup
+    if not isinstance(allowed_roles, list):
+        allowed_roles = [allowed_roles]
+    allowed = frozenset(allowed_roles)
+
     def inner(user: Annotated[dict, Depends(get_current_user)]):
-        if isinstance(allowed_roles, list):
-            if user['role'] not in allowed_roles:
-                raise HTTPException(status_code=403, detail="Operation not permitted")
-        elif user['role'] != allowed_roles:
+        if user['role'] not in allowed:
             raise HTTPException(status_code=403, detail="Operation not permitted")
         return user
     return inner
\ No newline at end of file
@@ -1,14 +1,39 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from .routers import auth, products, branches, branch_products, inventory_reports, clients, transactions, expenses, suppliers, analytics, app_management
 from fastapi.staticfiles import StaticFiles
+import os
+from anyio import to_thread
 
-from .database import Base, engine
+from .database import Base, engine, DB_POOL_SIZE, DB_MAX_OVERFLOW
 
 app = FastAPI()
 
+# Sync handlers run in anyio's worker threads. One thread per pooled connection
+# means a burst of requests queues in the event loop instead of parking threads
+# that would only wait on the pool until pool_timeout.
+@app.on_event("startup")
+async def size_threadpool():
+    to_thread.current_default_thread_limiter().total_tokens = DB_POOL_SIZE + DB_MAX_OVERFLOW
+
 app.mount("/product_images", StaticFiles(directory="static/product_images"), name="product_images")
-app.mount("/apk_files", StaticFiles(directory="static/apk_files"), name="apk_files")
+
+# Behind nginx, APK downloads are handed back to it with X-Accel-Redirect so the
+# file goes out through sendfile instead of being streamed by the app. nginx needs
+# a matching internal location, e.g.
+#   location /internal/apk_files/ { internal; alias /path/to/static/apk_files/; sendfile on; tcp_nopush on; }
+APK_ACCEL_REDIRECT_PREFIX = os.getenv('APK_ACCEL_REDIRECT_PREFIX')
+if APK_ACCEL_REDIRECT_PREFIX:
+    @app.get("/apk_files/{filename}", include_in_schema=False)
+    def download_apk(filename: str):
+        if os.path.basename(filename) != filename or not filename.endswith('.apk'):
+            raise HTTPException(status_code=404, detail="Not Found")
+        return Response(headers={
+            "X-Accel-Redirect": f"{APK_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{filename}",
+            "Content-Type": "application/vnd.android.package-archive"
+        })
+else:
+    app.mount("/apk_files", StaticFiles(directory="static/apk_files"), name="apk_files")
 
 Base.metadata.create_all(bind=engine)
 
@@ -23,6 +48,7 @@ app.add_middleware(
     allow_credentials = True,
     allow_methods = ["*"], # Allows all methods
     allow_headers = ["*"], # Allows all headers
+    expose_headers = ["X-Total-Count"], # Paged list totals
 )
 
 @app.get("/")
@@ -1,12 +1,14 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Table, Float, Date, select, DateTime, ARRAY
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Table, Float, Date, select, DateTime, ARRAY, Index, text
 from sqlalchemy.orm import relationship, column_property
 from .database import Base, engine
-from datetime import date, datetime, timezone
+from datetime import date, datetime, timezone, timedelta
 from enum import Enum
-from sqlalchemy import func
+from sqlalchemy import func, case
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import List, Optional
 from sqlalchemy.orm import object_session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql
 
 
 class UserRole(str, Enum):
@@ -70,12 +72,14 @@ class BranchProduct(Base):
 
     product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
     branch_id = Column(Integer, ForeignKey('branches.id'), primary_key=True)
+    # Sum of the active batches, maintained by the product_batches_sync_quantity trigger
     quantity = Column(Integer)
     is_available = Column(Boolean, default=False)
     low_stock_since = Column(DateTime, nullable=True)
     
     product = relationship("Product", back_populates="branch_products")
     branch = relationship("Branch", back_populates="branch_products")
+
     batches = relationship(
         "ProductBatch",
         primaryjoin="and_(BranchProduct.product_id==foreign(ProductBatch.product_id), "
@@ -83,6 +87,11 @@ class BranchProduct(Base):
         backref="branch_product"
     )
 
+    __table_args__ = (
+        # The primary key leads with product_id, so per-branch listings need their own index
+        Index('ix_branch_products_branch', 'branch_id'),
+    )
+
     @property
     def peso_value(self):
         return self.quantity * self.product.cost
@@ -139,6 +148,32 @@ class BranchProduct(Base):
         delta = now - self.low_stock_since
         return max(0, delta.days)  # Ensure we don't return negative days
 
+    @classmethod
+    def sync_low_stock_since(cls, db: Session, branch_id: Optional[int] = None):
+        """Stamp or clear low_stock_since on available products whose low-stock state changed.
+
+        Applies the is_low_stock rule to every matching row in one UPDATE, for
+        list endpoints that read the flag in SQL rather than through the property.
+        """
+        threshold = case(
+            (Branch.branch_type == BranchType.WHOLESALE.value, Product.wholesale_low_stock_threshold),
+            else_=Product.retail_low_stock_threshold
+        )
+        is_low = func.coalesce(cls.quantity, 0) <= threshold
+        query = db.query(cls).filter(
+            cls.product_id == Product.id,
+            cls.branch_id == Branch.id,
+            cls.is_available == True,
+            is_low != cls.low_stock_since.isnot(None)
+        )
+        if branch_id is not None:
+            query = query.filter(cls.branch_id == branch_id)
+        query.update(
+            {cls.low_stock_since: case((is_low, datetime.now()), else_=None)},
+            synchronize_session=False
+        )
+        db.commit()
+
 class InvReport(Base):
     __tablename__ = "invreports"
 
@@ -151,6 +186,12 @@ class InvReport(Base):
     items = relationship("InvReportItem", back_populates="invreport")
     branch = relationship("Branch", back_populates="invreports")
 
+    # Lets the branch/date-window analytics find report ids without touching the heap
+    __table_args__ = (
+        Index('ix_invreports_branch_created', 'branch_id', 'created_at', postgresql_include=['id']),
+        Index('ix_invreports_branch_end_date', 'branch_id', 'end_date'),
+    )
+
     @property
     def is_viewed(self) -> bool:
         return self.viewed_by is not None
@@ -185,6 +226,9 @@ class InvReport(Base):
             return 0
         return len({item.product_id for item in self.items if item.offtake > 0})
 
+# Matches the date(created_at) day buckets used by the analytics trends
+Index('ix_invreports_created_day', func.date(InvReport.created_at))
+
 class InvReportItem(Base):
     __tablename__ = "invreport_items"
 
@@ -201,6 +245,15 @@ class InvReportItem(Base):
     product = relationship("Product", back_populates="inv_report_items")
     batches = relationship("InvReportBatch", back_populates="invreport_item")
 
+    # Covers the report -> item join for the revenue and profit sums
+    __table_args__ = (
+        Index(
+            'ix_invreport_items_report_totals',
+            'invreport_id',
+            postgresql_include=['product_id', 'offtake', 'current_srp', 'current_cost']
+        ),
+    )
+
     @property
     def peso_value(self):
         return self.selling_area * self.current_cost
@@ -279,6 +332,10 @@ class Expense(Base):
     branch = relationship("Branch", backref="expenses")
     created_by = relationship("User", backref="created_expenses")
 
+    __table_args__ = (
+        Index('ix_expenses_branch_date', 'branch_id', 'date_created'),
+    )
+
     @classmethod
     def get_branch_expenses(cls, db: Session, branch_id: int, start_date: date = None, end_date: date = None):
         """Get only branch-specific expenses"""
@@ -358,6 +415,23 @@ class ProductBatch(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.now)
 
+    __table_args__ = (
+        # Lets active-quantity sums per branch product run as index-only scans
+        Index(
+            'ix_product_batches_active_totals',
+            'branch_id', 'product_id',
+            postgresql_include=['quantity'],
+            postgresql_where=text('is_active')
+        ),
+        # Near-expiry lookups only ever look at active batches still in stock
+        Index(
+            'ix_product_batches_active_expiry',
+            'expiration_date',
+            postgresql_include=['branch_id', 'product_id'],
+            postgresql_where=text('is_active AND quantity > 0')
+        ),
+    )
+
     @property
     def days_until_expiry(self):
         return (self.expiration_date - date.today()).days
@@ -549,6 +623,213 @@ class AnalyticsTimeSeries(Base):
         db.commit()
         return metric
 
+    @classmethod
+    def record_metrics(cls, db: Session, metrics: list):
+        """Record several metric data points in a single commit"""
+        db.add_all(cls(**metric) for metric in metrics)
+        db.commit()
+
+class DailyBranchMetric(Base):
+    """Per-day sales rollup of inventory reports, keyed on the report end date"""
+    __tablename__ = "daily_branch_metrics"
+
+    day = Column(Date, primary_key=True)
+    branch_id = Column(Integer, ForeignKey('branches.id'), primary_key=True)
+    revenue = Column(Float, nullable=False, default=0.0)
+    cost = Column(Float, nullable=False, default=0.0)
+    quantity = Column(Integer, nullable=False, default=0)
+    refreshed_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    @property
+    def profit(self):
+        return self.revenue - self.cost
+
+    @classmethod
+    def refresh(cls, db: Session, branch_id: int, day: date):
+        """Recompute the rollup row for one branch and day from its inventory reports"""
+        day_start = datetime.combine(day, datetime.min.time())
+        totals = db.query(
+            func.coalesce(func.sum(InvReportItem.offtake * InvReportItem.current_srp), 0).label('revenue'),
+            func.coalesce(func.sum(InvReportItem.offtake * InvReportItem.current_cost), 0).label('cost'),
+            func.coalesce(func.sum(InvReportItem.offtake), 0).label('quantity')
+        ).join(
+            InvReport,
+            InvReport.id == InvReportItem.invreport_id
+        ).filter(
+            InvReport.branch_id == branch_id,
+            InvReport.end_date >= day_start,
+            InvReport.end_date < day_start + timedelta(days=1)
+        ).one()
+
+        # Upsert so concurrent reports for the same branch and day can't both insert
+        stmt = postgresql.insert(cls).values(
+            day=day,
+            branch_id=branch_id,
+            revenue=totals.revenue,
+            cost=totals.cost,
+            quantity=totals.quantity,
+            refreshed_at=datetime.now()
+        )
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=['day', 'branch_id'],
+            set_={
+                'revenue': stmt.excluded.revenue,
+                'cost': stmt.excluded.cost,
+                'quantity': stmt.excluded.quantity,
+                'refreshed_at': stmt.excluded.refreshed_at
+            }
+        ))
+        db.commit()
+
+    @classmethod
+    def refresh_range(cls, db: Session, start_day: date, end_day: date):
+        """Rebuild the rollup rows of every branch for days in [start_day, end_day]"""
+        window_start = datetime.combine(start_day, datetime.min.time())
+        window_end = datetime.combine(end_day + timedelta(days=1), datetime.min.time())
+        totals = db.query(
+            func.date(InvReport.end_date).label('day'),
+            InvReport.branch_id,
+            func.coalesce(func.sum(InvReportItem.offtake * InvReportItem.current_srp), 0).label('revenue'),
+            func.coalesce(func.sum(InvReportItem.offtake * InvReportItem.current_cost), 0).label('cost'),
+            func.coalesce(func.sum(InvReportItem.offtake), 0).label('quantity')
+        ).join(
+            InvReportItem,
+            InvReport.id == InvReportItem.invreport_id
+        ).filter(
+            InvReport.branch_id.isnot(None),
+            InvReport.end_date >= window_start,
+            InvReport.end_date < window_end
+        ).group_by(
+            func.date(InvReport.end_date),
+            InvReport.branch_id
+        ).all()
+
+        # Replace the whole window in one transaction so days whose reports
+        # were edited or removed don't keep stale totals
+        db.query(cls).filter(
+            cls.day >= start_day,
+            cls.day <= end_day
+        ).delete(synchronize_session=False)
+        db.add_all(
+            cls(
+                day=row.day,
+                branch_id=row.branch_id,
+                revenue=row.revenue,
+                cost=row.cost,
+                quantity=row.quantity
+            )
+            for row in totals
+        )
+        db.commit()
+        return len(totals)
+
+class MonthlyBranchMetric(Base):
+    """Per-month revenue and expense rollup for closed months, keyed on report creation date"""
+    __tablename__ = "monthly_branch_metrics"
+
+    month = Column(Date, primary_key=True)
+    branch_id = Column(Integer, ForeignKey('branches.id'), primary_key=True)
+    revenue = Column(Float, nullable=False, default=0.0)
+    expenses = Column(Float, nullable=False, default=0.0)
+    refreshed_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    @staticmethod
+    def month_bounds(month: date):
+        month_start = month.replace(day=1)
+        next_month_start = (month_start + timedelta(days=32)).replace(day=1)
+        return month_start, next_month_start
+
+    @classmethod
+    def compute(cls, db: Session, month: date, branch_ids: Optional[List[int]] = None):
+        """Revenue and expenses per branch for one month, read from the source rows"""
+        month_start, next_month_start = cls.month_bounds(month)
+        window_start = datetime.combine(month_start, datetime.min.time())
+        window_end = datetime.combine(next_month_start, datetime.min.time())
+
+        revenue_query = db.query(
+            InvReport.branch_id,
+            func.sum(InvReportItem.offtake * InvReportItem.current_srp)
+        ).join(
+            InvReport,
+            InvReport.id == InvReportItem.invreport_id
+        ).filter(
+            InvReport.created_at >= window_start,
+            InvReport.created_at < window_end
+        )
+
+        expense_query = db.query(
+            Expense.branch_id,
+            func.sum(Expense.amount)
+        ).filter(
+            Expense.branch_id.isnot(None),
+            Expense.date_created >= month_start,
+            Expense.date_created < next_month_start
+        )
+
+        if branch_ids is not None:
+            revenue_query = revenue_query.filter(InvReport.branch_id.in_(branch_ids))
+            expense_query = expense_query.filter(Expense.branch_id.in_(branch_ids))
+
+        revenue = dict(revenue_query.group_by(InvReport.branch_id).all())
+        expenses = dict(expense_query.group_by(Expense.branch_id).all())
+        return revenue, expenses
+
+    @classmethod
+    def refresh(cls, db: Session, month: date):
+        """Recompute the rollup rows of every branch for one month"""
+        month_start, _ = cls.month_bounds(month)
+        revenue, expenses = cls.compute(db, month_start)
+
+        # Every branch gets a row so a refreshed month is distinguishable from a missing one
+        existing = {m.branch_id: m for m in db.query(cls).filter(cls.month == month_start).all()}
+        for (branch_id,) in db.query(Branch.id).all():
+            metric = existing.get(branch_id)
+            if metric is None:
+                metric = cls(month=month_start, branch_id=branch_id)
+                db.add(metric)
+            metric.revenue = revenue.get(branch_id) or 0.0
+            metric.expenses = expenses.get(branch_id) or 0.0
+        try:
+            db.commit()
+        except IntegrityError:
+            # A concurrent refresh built the same month first
+            db.rollback()
+
+    @classmethod
+    def ensure(cls, db: Session, month: date):
+        """Materialize a month if it has no rows yet"""
+        month_start, _ = cls.month_bounds(month)
+        if db.query(cls.month).filter(cls.month == month_start).first() is None:
+            cls.refresh(db, month_start)
+
+    @classmethod
+    def totals(cls, db: Session, month: date, branch_ids: List[int]):
+        """Summed revenue and expenses of some branches for one month.
+
+        Reads the rollup when refresh_metrics has materialized the month and
+        otherwise computes the figures from the source rows; never writes.
+        """
+        month_start, _ = cls.month_bounds(month)
+        if db.query(cls.month).filter(cls.month == month_start).first() is not None:
+            revenue, expenses = db.query(
+                func.coalesce(func.sum(cls.revenue), 0),
+                func.coalesce(func.sum(cls.expenses), 0)
+            ).filter(
+                cls.month == month_start,
+                cls.branch_id.in_(branch_ids)
+            ).one()
+            return revenue, expenses
+        revenue, expenses = cls.compute(db, month_start, branch_ids)
+        return sum(v or 0 for v in revenue.values()), sum(v or 0 for v in expenses.values())
+
+    @classmethod
+    def invalidate(cls, db: Session, day: date):
+        """Drop a closed month's rows so the next read rebuilds them"""
+        month_start, _ = cls.month_bounds(day)
+        if month_start < date.today().replace(day=1):
+            db.query(cls).filter(cls.month == month_start).delete(synchronize_session=False)
+            db.commit()
+
 class PriceHistory(Base):
     __tablename__ = 'price_history'
     
@@ -564,8 +845,8 @@ class AppVersion(Base):
     __tablename__ = "app_versions"
 
     id = Column(Integer, primary_key=True, index=True)
-    version_name = Column(String, nullable=False)  # e.g., "1.0.0"
-    version_code = Column(Integer, nullable=False)  # e.g., 1
+    version_name = Column(String, nullable=False, unique=True)  # e.g., "1.0.0"
+    version_code = Column(Integer, nullable=False, unique=True)  # e.g., 1
     apk_file_path = Column(String, nullable=False)
     release_notes = Column(String, nullable=True)
     is_active = Column(Boolean, default=False)
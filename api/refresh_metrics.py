@@ -0,0 +1,41 @@
+"""Rebuild the analytics rollup tables from the raw report and expense rows.
+
+Report submission keeps today's daily rollup current; this catches edits and
+deletions the submit hook never sees. It also builds the closed-month rollup
+that the monthly comparison reads, including months whose rows were dropped
+after an expense edit. Meant to be run from cron, e.g.
+
+    */15 * * * * cd /srv/pharmassist_api && python -m api.refresh_metrics --days 3
+"""
+import argparse
+from datetime import date, timedelta
+
+from .database import SessionLocal
+from .models import DailyBranchMetric, MonthlyBranchMetric
+
+
+def refresh_metrics(days: int, months: int = 2):
+    db = SessionLocal()
+    try:
+        end_day = date.today()
+        start_day = end_day - timedelta(days=days - 1)
+        rows = DailyBranchMetric.refresh_range(db, start_day, end_day)
+        print(f"daily_branch_metrics: rebuilt {start_day} to {end_day} ({rows} rows)")
+
+        # Reads compute missing months on the fly without storing them, so
+        # build any closed month that has no rows yet
+        month = end_day.replace(day=1)
+        for _ in range(months):
+            month = (month - timedelta(days=1)).replace(day=1)
+            MonthlyBranchMetric.ensure(db, month)
+            print(f"monthly_branch_metrics: ensured {month:%B %Y}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh analytics rollup tables")
+    parser.add_argument("--days", type=int, default=3, help="number of recent days to rebuild (default: 3)")
+    parser.add_argument("--months", type=int, default=2, help="number of closed months to build if missing (default: 2)")
+    args = parser.parse_args()
+    refresh_metrics(args.days, args.months)
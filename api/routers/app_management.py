@@ -1,20 +1,29 @@
 from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File, Form
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, raiseload
+from sqlalchemy.exc import IntegrityError
+from typing import List, Optional, Annotated
 from pydantic import BaseModel
 import os
-import shutil
+import re
+import tempfile
+import aiofiles
 from datetime import datetime
 
 from api.models import AppVersion, UserRole
 from api.deps import db_dependency, role_required
+from api.cache import active_version_cache
 
 router = APIRouter(
     prefix='/app-management',
     tags=['app-management']
 )
 
+admin_dependency = Annotated[dict, Depends(role_required(UserRole.ADMIN))]
+
 UPLOAD_DIR = "static/apk_files"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+VERSION_NAME_PATTERN = re.compile(r'\d+\.\d+\.\d+', re.ASCII)
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
@@ -42,151 +51,167 @@ class AppVersionResponse(AppVersionBase):
     created_at: datetime
 
     model_config = {
-        "from_attributes": True,
-        "json_schema_extra": {
-            "examples": [
-                {
-                    "id": 1,
-                    "version_name": "1.0.0",
-                    "version_code": 1,
-                    "apk_file_path": "/apk_files/pomona_v1.0.0.apk",
-                    "release_notes": "Initial release",
-                    "is_active": True,
-                    "created_at": "2024-03-20T12:00:00"
-                }
-            ]
-        }
+        "from_attributes": True
     }
 
+def create_active_version(db: Session, version_name: str, version_code: int, filename: str,
+                          release_notes: Optional[str], created_by_id: int):
+    """Insert a new app version and make it the only active one"""
+    try:
+        # Deactivate current active version if exists
+        current_active = db.query(AppVersion).filter(AppVersion.is_active == True).first()
+        if current_active:
+            current_active.is_active = False
+            
+        # Create new version
+        new_version = AppVersion(
+            version_name=version_name,
+            version_code=version_code,
+            apk_file_path=f"/apk_files/{filename}",
+            release_notes=release_notes,
+            is_active=True,
+            created_by_id=created_by_id
+        )
+        
+        db.add(new_version)
+        db.commit()
+        db.refresh(new_version)
+        
+        return new_version
+
+    except IntegrityError as e:
+        # Duplicate versions are rejected by the unique constraints
+        db.rollback()
+        constraint = getattr(getattr(e.orig, 'diag', None), 'constraint_name', None)
+        if constraint == 'app_versions_version_code_key':
+            detail = f"Version code {version_code} already exists"
+        elif constraint == 'app_versions_version_name_key':
+            detail = f"Version name {version_name} already exists"
+        else:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Database error: {str(e)}"
+            )
+        raise HTTPException(
+            status_code=400,
+            detail=detail
+        )
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Database error: {str(e)}"
+        )
+
 @router.post("/upload", response_model=AppVersionResponse)
 async def upload_apk(
     db: db_dependency,
+    user: admin_dependency,
     apk_file: UploadFile = File(...),
     version_name: str = Form(...),
     version_code: str = Form(...),
-    release_notes: Optional[str] = Form(None),
-    user: dict = Depends(role_required(UserRole.ADMIN))
+    release_notes: Optional[str] = Form(None)
 ):
-    file_path = None
+    # Validate version code
     try:
-        # Validate version code
-        try:
-            version_code = int(version_code)
-        except ValueError:
-            raise HTTPException(
-                status_code=400,
-                detail="Version code must be a valid integer"
-            )
-
-        # Validate version name format (e.g., "1.0.0")
-        if not version_name.replace(".", "").isdigit():
-            raise HTTPException(
-                status_code=400,
-                detail="Version name must be in format X.Y.Z (e.g., 1.0.0)"
-            )
+        version_code = int(version_code)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="Version code must be a valid integer"
+        )
 
-        # Check if version code already exists
-        existing_version = db.query(AppVersion).filter(
-            AppVersion.version_code == version_code
-        ).first()
-        if existing_version:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Version code {version_code} already exists"
-            )
+    # Validate version name format (e.g., "1.0.0")
+    if not VERSION_NAME_PATTERN.fullmatch(version_name):
+        raise HTTPException(
+            status_code=400,
+            detail="Version name must be in format X.Y.Z (e.g., 1.0.0)"
+        )
 
-        # Check if version name already exists
-        existing_version = db.query(AppVersion).filter(
-            AppVersion.version_name == version_name
-        ).first()
-        if existing_version:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Version name {version_name} already exists"
-            )
+    # Validate file type
+    if not apk_file.filename.endswith('.apk'):
+        raise HTTPException(
+            status_code=400,
+            detail="File must be an APK"
+        )
+    
+    # Generate unique filename
+    filename = f"pomona_v{version_name}.apk"
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    
+    # Check if file already exists
+    if os.path.exists(file_path):
+        raise HTTPException(
+            status_code=400,
+            detail="A version with this name already exists"
+        )
 
-        # Validate file type
-        if not apk_file.filename.endswith('.apk'):
-            raise HTTPException(
-                status_code=400,
-                detail="File must be an APK"
-            )
-        
-        # Generate unique filename
-        filename = f"pomona_v{version_name}.apk"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        
-        # Check if file already exists
-        if os.path.exists(file_path):
-            raise HTTPException(
-                status_code=400,
-                detail="A version with this name already exists"
-            )
-        
-        # Save file
+    # Each request streams into its own temporary file, which only takes the
+    # final name once the version row is committed
+    fd, partial_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".partial")
+    os.close(fd)
+    try:
         try:
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(apk_file.file, buffer)
-        except Exception as e:
+            # Stream in 1 MiB chunks without blocking the event loop
+            async with aiofiles.open(partial_path, "wb") as buffer:
+                while chunk := await apk_file.read(UPLOAD_CHUNK_SIZE):
+                    await buffer.write(chunk)
+        except OSError as e:
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to save file: {str(e)}"
             )
-            
-        # Database operations
-        try:
-            # Deactivate current active version if exists
-            current_active = db.query(AppVersion).filter(AppVersion.is_active == True).first()
-            if current_active:
-                current_active.is_active = False
-                
-            # Create new version
-            new_version = AppVersion(
-                version_name=version_name,
-                version_code=version_code,
-                apk_file_path=f"/apk_files/{filename}",
-                release_notes=release_notes,
-                is_active=True,
-                created_by_id=user['id']
-            )
-            
-            db.add(new_version)
-            db.commit()
-            db.refresh(new_version)
-            
-            return new_version
-            
-        except Exception as e:
-            db.rollback()
-            raise HTTPException(
-                status_code=500,
-                detail=f"Database error: {str(e)}"
-            )
-            
-    except HTTPException as he:
-        # Clean up file if it was created
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
-        raise he
-    except Exception as e:
-        # Clean up file if it was created
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
-        raise HTTPException(
-            status_code=500,
-            detail=str(e)
+
+        # Blocking database work runs in the threadpool, off the event loop
+        new_version = await run_in_threadpool(
+            create_active_version,
+            db,
+            version_name,
+            version_code,
+            filename,
+            release_notes,
+            user['id']
         )
 
+        # mkstemp creates the file owner-only; downloads need it world-readable
+        os.chmod(partial_path, 0o644)
+        os.replace(partial_path, file_path)
+        active_version_cache.clear()
+        return new_version
+    finally:
+        # Only this request's file, and only left behind when saving or the insert failed
+        try:
+            os.unlink(partial_path)
+        except FileNotFoundError:
+            pass
+
 @router.get("/versions", response_model=List[AppVersionResponse])
-async def get_versions(
+def get_versions(
     db: db_dependency,
-    user: dict = Depends(role_required(UserRole.ADMIN))
+    user: admin_dependency
 ):
-    return db.query(AppVersion).order_by(AppVersion.created_at.desc()).all()
+    return db.query(AppVersion).options(raiseload('*')).order_by(AppVersion.created_at.desc()).all()
 
 @router.get("/active-version")
-async def get_active_version(db: db_dependency):
+def get_active_version(db: db_dependency):
+    cached = active_version_cache.get("active")
+    if cached is not None:
+        return cached
+
     version = db.query(AppVersion).filter(AppVersion.is_active == True).first()
     if not version:
         raise HTTPException(status_code=404, detail="No active version found")
-    return version 
\ No newline at end of file
+
+    # Same fields the ORM object serialized to, kept as a plain dict for cache hits
+    active_version = {
+        "id": version.id,
+        "version_name": version.version_name,
+        "version_code": version.version_code,
+        "apk_file_path": version.apk_file_path,
+        "release_notes": version.release_notes,
+        "is_active": version.is_active,
+        "created_at": version.created_at,
+        "created_by_id": version.created_by_id
+    }
+    active_version_cache.set("active", active_version)
+    return active_version 
\ No newline at end of file
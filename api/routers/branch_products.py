@@ -1,27 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional, Annotated
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, TypeAdapter
 from datetime import date, datetime
 
 from api.models import BranchProduct, Branch, Product, UserRole, BranchType
 from api.deps import db_dependency, role_required
-from sqlalchemy.orm import joinedload
+from api.cache import branch_product_cache
+from sqlalchemy.orm import raiseload
 import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
 from api.models import ProductBatch
 
 router = APIRouter(
     prefix='/branch-products',
-    tags=['branch products']
+    tags=['branch products'],
+    default_response_class=ORJSONResponse
 )
 
+# Built once at import and shared by every route below
+admin_dependency = Annotated[dict, Depends(role_required(UserRole.ADMIN))]
+branch_staff_dependency = Annotated[dict, Depends(role_required([UserRole.ADMIN, UserRole.PHARMACIST, UserRole.WHOLESALER]))]
+
 class BranchProductBase(BaseModel):
     product_id: int
     branch_id: int
     quantity: int
 
-class BranchProductCreate(BranchProductBase):
-    pass
+class BranchProductCreate(BaseModel):
+    # quantity is not accepted; the database derives it from the active batches
+    product_id: int
+    branch_id: int
 
 class BranchProductUpdate(BaseModel):
     expiration_date: Optional[date] = None
@@ -67,11 +77,64 @@ class LowStockSummary(BaseModel):
 class AvailabilityUpdate(BaseModel):
     is_available: bool
 
+# The list endpoints validate and encode their rows in one pass through
+# pydantic-core and return the bytes, so FastAPI does not validate them again.
+# response_model stays on the routes for the OpenAPI schema.
+branch_product_list_adapter = TypeAdapter(List[BranchProductResponse])
+low_stock_list_adapter = TypeAdapter(List[LowStockProductResponse])
+
+def json_response(adapter, rows):
+    return adapter.dump_json(adapter.validate_python(rows))
+
+def active_batch_totals():
+    """Quantity and earliest expiration of the active batches per branch product"""
+    return sa.select(
+        ProductBatch.branch_id,
+        ProductBatch.product_id,
+        sa.func.sum(ProductBatch.quantity).label('total_quantity'),
+        sa.func.min(ProductBatch.expiration_date).label('earliest_expiration')
+    ).where(
+        ProductBatch.is_active == True
+    ).group_by(
+        ProductBatch.branch_id,
+        ProductBatch.product_id
+    ).subquery('batch_totals')
+
+def low_stock_threshold():
+    """The product's threshold for the joined branch's type"""
+    return sa.case(
+        (Branch.branch_type == BranchType.WHOLESALE.value, Product.wholesale_low_stock_threshold),
+        else_=Product.retail_low_stock_threshold
+    )
+
+def branch_product_response(bp, product, branch, active_quantity, earliest_expiration, is_low_stock):
+    """BranchProductResponse fields from already loaded rows and batch totals"""
+    return {
+        "id": f"{bp.branch_id}-{bp.product_id}",
+        "product_id": bp.product_id,
+        "branch_id": bp.branch_id,
+        "quantity": active_quantity,
+        "peso_value": active_quantity * product.cost,
+        "current_expiration_date": earliest_expiration,
+        "is_low_stock": is_low_stock,
+        "active_quantity": active_quantity,
+        "is_available": bp.is_available,
+        "branch_type": branch.branch_type,
+        "is_retail_available": product.is_retail_available,
+        "is_wholesale_available": product.is_wholesale_available,
+        "retail_low_stock_threshold": product.retail_low_stock_threshold,
+        "wholesale_low_stock_threshold": product.wholesale_low_stock_threshold,
+        "product_name": product.name,
+        "days_in_low_stock": bp.days_in_low_stock,
+        "low_stock_since": bp.low_stock_since,
+        "image_url": product.image_url
+    }
+
 @router.post('/', response_model=BranchProductResponse, status_code=status.HTTP_201_CREATED)
 def create_branch_product(
     branch_product: BranchProductCreate,
     db: db_dependency,
-    user: Annotated[dict, Depends(role_required(UserRole.ADMIN))]
+    user: admin_dependency
 ):
     # Get branch type
     branch = db.query(Branch).filter(Branch.id == branch_product.branch_id).first()
@@ -94,56 +157,141 @@ def create_branch_product(
             detail="This product is not available for retail branches"
         )
 
-    db_branch_product = BranchProduct(**branch_product.dict())
-    db.add(db_branch_product)
+    # The insert trigger fills quantity from any existing active batches;
+    # RETURNING hands the stored row back without a reload
+    db_branch_product = db.execute(
+        sa.insert(BranchProduct)
+        .values(**branch_product.model_dump(), quantity=0)
+        .returning(BranchProduct)
+    ).scalar_one()
+    # Built before commit, which expires the loaded rows; new rows start
+    # unavailable, which never counts as low stock
+    response = branch_product_response(
+        db_branch_product, product, branch, db_branch_product.quantity or 0, None, False
+    )
+    db.commit()
+    branch_product_cache.clear()
+    return response
+
+@router.post('/bulk', status_code=status.HTTP_201_CREATED)
+def create_branch_products_bulk(
+    branch_products: List[BranchProductCreate],
+    db: db_dependency,
+    user: admin_dependency
+):
+    """Create many branch products in one INSERT, skipping pairs that already exist"""
+    if not branch_products:
+        return {"created": 0, "skipped": 0}
+
+    # Fetch every referenced branch and product up front, one query each
+    branch_types = dict(db.query(Branch.id, Branch.branch_type).filter(
+        Branch.id.in_({bp.branch_id for bp in branch_products})
+    ).all())
+    products = {
+        product.id: product
+        for product in db.query(Product).filter(
+            Product.id.in_({bp.product_id for bp in branch_products})
+        ).all()
+    }
+
+    for bp in branch_products:
+        if bp.branch_id not in branch_types:
+            raise HTTPException(status_code=404, detail=f"Branch {bp.branch_id} not found")
+        product = products.get(bp.product_id)
+        if not product:
+            raise HTTPException(status_code=404, detail=f"Product {bp.product_id} not found")
+        if branch_types[bp.branch_id] == 'wholesale' and not product.is_wholesale_available:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Product {product.id} is not available for wholesale branches"
+            )
+        elif branch_types[bp.branch_id] == 'retail' and not product.is_retail_available:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Product {product.id} is not available for retail branches"
+            )
+
+    # quantity is filled from the active batches by the insert trigger
+    stmt = insert(BranchProduct).values(
+        [{**bp.model_dump(), "quantity": 0} for bp in branch_products]
+    ).on_conflict_do_nothing(index_elements=['product_id', 'branch_id'])
+    result = db.execute(stmt)
     db.commit()
-    db.refresh(db_branch_product)
-    return db_branch_product
+    branch_product_cache.clear()
+
+    return {
+        "created": result.rowcount,
+        "skipped": len(branch_products) - result.rowcount
+    }
 
 @router.get('/', response_model=List[BranchProductResponse])
 def get_branch_products(
     db: db_dependency,
-    user: Annotated[dict, Depends(role_required([UserRole.ADMIN, UserRole.PHARMACIST, UserRole.WHOLESALER]))],
+    user: branch_staff_dependency,
     branch_id: Optional[int] = None,
     product_id: Optional[int] = None,
-    low_stock_only: bool = False
+    low_stock_only: bool = False,
+    skip: int = 0,
+    limit: int = 1000
 ):
+    # Pharmacists and wholesalers only ever see their own branch
+    if user['role'] in (UserRole.PHARMACIST, UserRole.WHOLESALER):
+        scope_branch_id = user['branch_id']
+    else:
+        scope_branch_id = branch_id
+
+    cache_key = ("branch_products", scope_branch_id, branch_id, product_id, low_stock_only, skip, limit)
+    cached = branch_product_cache.get(cache_key)
+    if cached is not None:
+        body, total = cached
+        return Response(content=body, media_type="application/json", headers={"X-Total-Count": str(total)})
+
+    # Bring low_stock_since up to date in one statement before reading it
+    BranchProduct.sync_low_stock_since(db, scope_branch_id)
+
     # First get active batches with their quantities
-    batch_totals = db.query(
-        ProductBatch.branch_id,
-        ProductBatch.product_id,
-        sa.func.sum(ProductBatch.quantity).label('total_quantity')
-    ).filter(
-        ProductBatch.is_active == True
-    ).group_by(
-        ProductBatch.branch_id,
-        ProductBatch.product_id
-    ).subquery()
+    batch_totals = active_batch_totals()
+    active_quantity = sa.func.coalesce(batch_totals.c.total_quantity, 0)
     
-    # Join with branch products
+    # Join with branch products; the batch sums come back as columns instead
+    # of every batch being loaded and summed here
     query = (
         db.query(
             BranchProduct,
             Product,
-            Branch
+            Branch,
+            active_quantity.label('active_quantity'),
+            batch_totals.c.earliest_expiration,
+            sa.and_(
+                BranchProduct.is_available == True,
+                active_quantity <= low_stock_threshold()
+            ).label('is_low_stock'),
+            # Rows matching the filters before paging, so clients can tell a
+            # capped page from the whole list
+            sa.func.count().over().label('total_count')
         )
         .join(Product)
         .join(Branch)
-        .options(
-            joinedload(BranchProduct.batches),
-            joinedload(BranchProduct.product),
-            joinedload(BranchProduct.branch)
-        )
+        .outerjoin(batch_totals, sa.and_(
+            batch_totals.c.branch_id == BranchProduct.branch_id,
+            batch_totals.c.product_id == BranchProduct.product_id
+        ))
+        .options(raiseload('*'))
     )
     
     # Apply filters
-    if user['role'] in [UserRole.PHARMACIST.value, UserRole.WHOLESALER.value]:
-        query = query.filter(BranchProduct.branch_id == user['branch_id'])
-    elif branch_id:
-        query = query.filter(BranchProduct.branch_id == branch_id)
+    if scope_branch_id:
+        query = query.filter(BranchProduct.branch_id == scope_branch_id)
         
     if product_id:
         query = query.filter(BranchProduct.product_id == product_id)
+
+    # Only low stock rows leave the database, so pages are full
+    if low_stock_only:
+        query = query.filter(
+            BranchProduct.is_available == True,
+            active_quantity <= low_stock_threshold()
+        )
     
     # Get branch type and filter products accordingly
     if branch_id:
@@ -156,44 +304,25 @@ def get_branch_products(
                 )
             )
     
-    # Add ordering by product name
-    query = query.order_by(Product.name)
+    # Add ordering by product name, with the key as a tiebreaker so pages are stable
+    query = query.order_by(Product.name, BranchProduct.branch_id, BranchProduct.product_id)
     
-    results = query.all()
+    results = query.offset(skip).limit(min(limit, 1000)).all()
+    if results:
+        total = results[0].total_count
+    elif skip:
+        # A page past the end carries no window count
+        total = query.order_by(None).count()
+    else:
+        total = 0
     
-    # Update quantities and filter low stock if requested
-    response = []
-    for bp, product, branch in results:
-        active_quantity = sum(
-            batch.quantity for batch in bp.batches 
-            if batch.is_active
-        )
-        bp.quantity = active_quantity
-        
-        if not low_stock_only or bp.is_low_stock:
-            response_item = {
-                "id": f"{bp.branch_id}-{bp.product_id}",
-                "product_id": bp.product_id,
-                "branch_id": bp.branch_id,
-                "quantity": bp.quantity,
-                "peso_value": bp.peso_value,
-                "current_expiration_date": bp.current_expiration_date,
-                "is_low_stock": bp.is_low_stock,
-                "active_quantity": active_quantity,
-                "is_available": bp.is_available,
-                "branch_type": branch.branch_type,
-                "is_retail_available": product.is_retail_available,
-                "is_wholesale_available": product.is_wholesale_available,
-                "retail_low_stock_threshold": product.retail_low_stock_threshold,
-                "wholesale_low_stock_threshold": product.wholesale_low_stock_threshold,
-                "product_name": product.name,
-                "days_in_low_stock": bp.days_in_low_stock,
-                "low_stock_since": bp.low_stock_since,
-                "image_url": product.image_url
-            }
-            response.append(response_item)
-    
-    return response
+    response = [
+        branch_product_response(bp, product, branch, active_quantity, earliest_expiration, is_low_stock)
+        for bp, product, branch, active_quantity, earliest_expiration, is_low_stock, _ in results
+    ]
+    body = json_response(branch_product_list_adapter, response)
+    branch_product_cache.set(cache_key, (body, total))
+    return Response(content=body, media_type="application/json", headers={"X-Total-Count": str(total)})
 
 @router.put('/{branch_id}/{product_id}', response_model=BranchProductResponse)
 def update_branch_product(
@@ -201,10 +330,10 @@ def update_branch_product(
     product_id: int,
     branch_product: BranchProductUpdate,
     db: db_dependency,
-    user: Annotated[dict, Depends(role_required([UserRole.ADMIN, UserRole.PHARMACIST, UserRole.WHOLESALER]))],
+    user: branch_staff_dependency,
 ):
     # Check if user is assigned to this branch
-    if user['role'] in [UserRole.PHARMACIST.value, UserRole.WHOLESALER.value] and user['branch_id'] != branch_id:
+    if user['role'] in (UserRole.PHARMACIST, UserRole.WHOLESALER) and user['branch_id'] != branch_id:
         raise HTTPException(
             status_code=403,
             detail="You can only modify products in your assigned branch"
@@ -241,17 +370,34 @@ def update_branch_product(
     
     for key, value in branch_product.dict(exclude_unset=True).items():
         setattr(db_branch_product, key, value)
-    
+
+    # The response is built before commit, which expires the loaded rows.
+    # quantity is kept equal to the active batch total by trigger
+    active_quantity = db_branch_product.quantity or 0
+    earliest_expiration = db.query(sa.func.min(ProductBatch.expiration_date)).filter(
+        ProductBatch.branch_id == branch_id,
+        ProductBatch.product_id == product_id,
+        ProductBatch.is_active == True
+    ).scalar()
+    threshold = (
+        product.wholesale_low_stock_threshold
+        if branch.branch_type == BranchType.WHOLESALE
+        else product.retail_low_stock_threshold
+    )
+    is_low_stock = db_branch_product.is_available and active_quantity <= threshold
+    response = branch_product_response(
+        db_branch_product, product, branch, active_quantity, earliest_expiration, is_low_stock
+    )
     db.commit()
-    db.refresh(db_branch_product)
-    return db_branch_product
+    branch_product_cache.clear()
+    return response
 
 @router.delete('/{branch_id}/{product_id}', status_code=status.HTTP_204_NO_CONTENT)
 def delete_branch_product(
     branch_id: int,
     product_id: int,
     db: db_dependency,
-    user: Annotated[dict, Depends(role_required(UserRole.ADMIN))]
+    user: admin_dependency
 ):
     db_branch_product = db.query(BranchProduct).filter(
         BranchProduct.branch_id == branch_id,
@@ -261,164 +407,177 @@ def delete_branch_product(
         raise HTTPException(status_code=404, detail="Branch product not found")
     db.delete(db_branch_product)
     db.commit()
+    branch_product_cache.clear()
     return {"detail": "Branch product deleted successfully"}
 
 @router.get('/low-stock/{branch_id}', response_model=List[LowStockProductResponse])
 def get_low_stock_products(
     branch_id: int,
     db: db_dependency,
-    user: Annotated[dict, Depends(role_required([UserRole.ADMIN, UserRole.PHARMACIST, UserRole.WHOLESALER]))],
+    user: branch_staff_dependency,
+    skip: int = 0,
+    limit: int = 1000
 ):
     """Get products that are below their low stock threshold"""
     
     # Check if user is assigned to this branch
-    if user['role'] in [UserRole.PHARMACIST.value, UserRole.WHOLESALER.value] and user['branch_id'] != branch_id:
+    if user['role'] in (UserRole.PHARMACIST, UserRole.WHOLESALER) and user['branch_id'] != branch_id:
         raise HTTPException(
             status_code=403,
             detail="You can only view products in your assigned branch"
         )
 
-    branch = db.query(Branch).filter(Branch.id == branch_id).first()
-    threshold_column = (
-        Product.wholesale_low_stock_threshold 
-        if branch.branch_type == 'wholesale' 
-        else Product.retail_low_stock_threshold
-    )
+    cache_key = ("low_stock", branch_id, skip, limit)
+    cached = branch_product_cache.get(cache_key)
+    if cached is not None:
+        body, total = cached
+        return Response(content=body, media_type="application/json", headers={"X-Total-Count": str(total)})
+
+    # Project just the response columns; no ORM rows are built. quantity is kept
+    # equal to the active batch total by trigger, so no batch aggregate is needed
+    current_quantity = sa.func.coalesce(BranchProduct.quantity, 0)
+    threshold = low_stock_threshold()
 
     query = (
         db.query(
-            Product,
-            Branch,
-            BranchProduct,
-            sa.func.sum(ProductBatch.quantity).label('current_quantity')
-        )
-        .join(BranchProduct, sa.and_(
-            BranchProduct.product_id == Product.id,
-            BranchProduct.branch_id == branch_id
-        ))
-        .join(Branch)
-        .outerjoin(ProductBatch, sa.and_(
-            ProductBatch.product_id == Product.id,
-            ProductBatch.branch_id == branch_id,
-            ProductBatch.is_active == True
-        ))
-        .filter(BranchProduct.is_available == True)
-        .group_by(
             Product.id,
-            Branch.id,
-            BranchProduct.product_id,
-            BranchProduct.branch_id,
-            BranchProduct.is_available
+            Product.name,
+            current_quantity.label('current_quantity'),
+            threshold.label('threshold'),
+            Branch.id.label('branch_id'),
+            Branch.branch_name,
+            BranchProduct.is_available,
+            sa.func.count().over().label('total_count')
         )
-        .having(
-            sa.or_(
-                sa.func.sum(ProductBatch.quantity) <= threshold_column,
-                sa.func.sum(ProductBatch.quantity) == None
-            )
+        .select_from(BranchProduct)
+        .join(Product, Product.id == BranchProduct.product_id)
+        .join(Branch, Branch.id == BranchProduct.branch_id)
+        .filter(
+            BranchProduct.branch_id == branch_id,
+            BranchProduct.is_available == True,
+            current_quantity <= threshold
         )
         .order_by(
-            (sa.func.coalesce(sa.func.sum(ProductBatch.quantity), 0) / threshold_column).asc(),
-            Product.name.asc()
+            (current_quantity / threshold).asc(),
+            Product.name.asc(),
+            BranchProduct.product_id
         )
     )
-
-    results = query.all()
+    results = query.offset(skip).limit(min(limit, 1000)).all()
+    if results:
+        total = results[0].total_count
+    elif skip:
+        # A page past the end carries no window count
+        total = query.order_by(None).count()
+    else:
+        total = 0
     
-    return [
+    low_stock_products = [
         {
-            "product_id": product.id,
-            "name": product.name,
-            "current_quantity": int(quantity or 0),
-            "threshold": (
-                product.wholesale_low_stock_threshold 
-                if branch.branch_type == 'wholesale' 
-                else product.retail_low_stock_threshold
-            ),
-            "branch_id": branch.id,
-            "branch_name": branch.branch_name,
-            "is_available": branch_product.is_available,
-            "low_stock_since": low_stock_since,
-            "days_in_low_stock": days_in_low_stock
+            "product_id": row.id,
+            "name": row.name,
+            "current_quantity": int(row.current_quantity),
+            "threshold": row.threshold,
+            "branch_id": row.branch_id,
+            "branch_name": row.branch_name,
+            "is_available": row.is_available
         }
-        for product, branch, branch_product, quantity, low_stock_since, days_in_low_stock in results
+        for row in results
     ]
+    body = json_response(low_stock_list_adapter, low_stock_products)
+    branch_product_cache.set(cache_key, (body, total))
+    return Response(content=body, media_type="application/json", headers={"X-Total-Count": str(total)})
 
 @router.get('/low-stock-summary/{branch_id}', response_model=LowStockSummary)
 def get_low_stock_summary(
     branch_id: int,
     db: db_dependency,
-    user: Annotated[dict, Depends(role_required([UserRole.ADMIN, UserRole.PHARMACIST, UserRole.WHOLESALER]))],
+    user: branch_staff_dependency,
+    skip: int = 0,
+    limit: int = 1000
 ):
     """Get a summary of low stock products for a branch"""
     
     # Check if user is assigned to this branch
-    if user['role'] in [UserRole.PHARMACIST.value, UserRole.WHOLESALER.value] and user['branch_id'] != branch_id:
+    if user['role'] in (UserRole.PHARMACIST, UserRole.WHOLESALER) and user['branch_id'] != branch_id:
         raise HTTPException(
             status_code=403,
             detail="You can only view products in your assigned branch"
         )
+
+    cache_key = ("low_stock_summary", branch_id, skip, limit)
+    cached = branch_product_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Keep low_stock_since current before it is read below
+    BranchProduct.sync_low_stock_since(db, branch_id)
     
     branch = db.query(Branch).filter(Branch.id == branch_id).first()
     if not branch:
         raise HTTPException(status_code=404, detail="Branch not found")
 
-    query = (
-        db.query(BranchProduct, Product, Branch)
-        .options(
-            joinedload(BranchProduct.batches),
-            joinedload(BranchProduct.product),
-            joinedload(BranchProduct.branch)
+    batch_totals = active_batch_totals()
+    active_quantity = sa.func.coalesce(batch_totals.c.total_quantity, 0)
+    is_low_stock = active_quantity <= low_stock_threshold()
+    in_summary = (
+        BranchProduct.branch_id == branch_id,
+        BranchProduct.is_available == True,
+        sa.case(
+            (branch.branch_type == 'wholesale', Product.is_wholesale_available),
+            else_=Product.is_retail_available
+        )
+    )
+
+    # Both counts in one aggregate instead of loading every product to len() it
+    counts = (
+        db.query(
+            sa.func.count().label('total_products'),
+            sa.func.count().filter(is_low_stock).label('low_stock_count')
         )
+        .select_from(BranchProduct)
         .join(Product)
         .join(Branch)
-        .filter(
-            BranchProduct.branch_id == branch_id,
-            BranchProduct.is_available == True,
-            sa.case(
-                (branch.branch_type == 'wholesale', Product.is_wholesale_available),
-                else_=Product.is_retail_available
-            )
-        )
+        .outerjoin(batch_totals, sa.and_(
+            batch_totals.c.branch_id == BranchProduct.branch_id,
+            batch_totals.c.product_id == BranchProduct.product_id
+        ))
+        .filter(*in_summary)
+        .one()
     )
 
-    results = query.all()
-    
-    total_products = len(results)
-    low_stock_products = []
-    
-    for bp, product, branch in results:
-        active_quantity = sum(
-            batch.quantity for batch in bp.batches 
-            if batch.is_active
+    # Only a page of the low stock rows is fetched; low_stock_count is the total
+    results = (
+        db.query(
+            BranchProduct,
+            Product,
+            active_quantity.label('active_quantity'),
+            batch_totals.c.earliest_expiration
         )
-        bp.quantity = active_quantity
-        
-        if bp.is_low_stock:
-            response_item = {
-                "id": f"{bp.branch_id}-{bp.product_id}",
-                "product_id": bp.product_id,
-                "branch_id": bp.branch_id,
-                "quantity": bp.quantity,
-                "peso_value": bp.peso_value,
-                "current_expiration_date": bp.current_expiration_date,
-                "is_low_stock": bp.is_low_stock,
-                "active_quantity": active_quantity,
-                "is_available": bp.is_available,
-                "branch_type": branch.branch_type,
-                "is_retail_available": product.is_retail_available,
-                "is_wholesale_available": product.is_wholesale_available,
-                "retail_low_stock_threshold": product.retail_low_stock_threshold,
-                "wholesale_low_stock_threshold": product.wholesale_low_stock_threshold,
-                "product_name": product.name,
-                "days_in_low_stock": bp.days_in_low_stock
-            }
-            low_stock_products.append(response_item)
+        .join(Product)
+        .join(Branch)
+        .outerjoin(batch_totals, sa.and_(
+            batch_totals.c.branch_id == BranchProduct.branch_id,
+            batch_totals.c.product_id == BranchProduct.product_id
+        ))
+        .options(raiseload('*'))
+        .filter(*in_summary, is_low_stock)
+        .order_by(Product.name, BranchProduct.product_id)
+        .offset(skip)
+        .limit(min(limit, 1000))
+        .all()
+    )
     
-    return {
-        "total_products": total_products,
-        "low_stock_count": len(low_stock_products),
-        "critical_products": low_stock_products
+    summary = {
+        "total_products": counts.total_products,
+        "low_stock_count": counts.low_stock_count,
+        "critical_products": [
+            branch_product_response(bp, product, branch, active_quantity, earliest_expiration, True)
+            for bp, product, active_quantity, earliest_expiration in results
+        ]
     }
+    branch_product_cache.set(cache_key, summary)
+    return summary
 
 @router.patch('/{branch_id}/{product_id}/availability')
 def update_product_availability(
@@ -426,10 +585,10 @@ def update_product_availability(
     product_id: int,
     availability: AvailabilityUpdate,
     db: db_dependency,
-    user: Annotated[dict, Depends(role_required([UserRole.ADMIN, UserRole.PHARMACIST, UserRole.WHOLESALER]))],
+    user: branch_staff_dependency,
 ):
     # Check if user is assigned to this branch
-    if user['role'] in [UserRole.PHARMACIST.value, UserRole.WHOLESALER.value] and user['branch_id'] != branch_id:
+    if user['role'] in (UserRole.PHARMACIST, UserRole.WHOLESALER) and user['branch_id'] != branch_id:
         raise HTTPException(
             status_code=403,
             detail="You can only modify products in your assigned branch"
@@ -456,15 +615,21 @@ def update_product_availability(
             detail="This product is not available for retail branches"
         )
 
-    db_branch_product = db.query(BranchProduct).filter(
-        BranchProduct.branch_id == branch_id,
-        BranchProduct.product_id == product_id
-    ).first()
+    # Single UPDATE ... RETURNING instead of select, flush and refresh
+    updated_id = db.execute(
+        sa.update(BranchProduct)
+        .where(
+            BranchProduct.branch_id == branch_id,
+            BranchProduct.product_id == product_id
+        )
+        .values(is_available=availability.is_available)
+        .returning(BranchProduct.product_id)
+        .execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
     
-    if not db_branch_product:
+    if updated_id is None:
         raise HTTPException(status_code=404, detail="Branch product not found")
     
-    db_branch_product.is_available = availability.is_available
     db.commit()
-    db.refresh(db_branch_product)
+    branch_product_cache.clear()
     return {"detail": "Availability updated successfully"}
\ No newline at end of file
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import Session, selectinload, raiseload
 from typing import Annotated, List, Optional
 from pydantic import BaseModel
 from datetime import datetime, timedelta
@@ -7,6 +7,7 @@ import sqlalchemy as sa
 
 from api.models import Branch, UserRole, Product, BranchProduct, ProductBatch
 from api.deps import db_dependency, role_required
+from api.cache import branch_product_cache, response_cache
 
 router = APIRouter(
     prefix='/branches',
@@ -60,6 +61,8 @@ def create_branch(
         db.add(branch_product)
 
     db.commit()
+    branch_product_cache.clear()
+    response_cache.clear()
     db.refresh(new_branch)
     return new_branch
 
@@ -69,45 +72,46 @@ def get_branches(
     user: Annotated[dict, Depends(role_required([UserRole.ADMIN, UserRole.PHARMACIST, UserRole.WHOLESALER]))],
 ):
     query = db.query(Branch)
+    scope_branch_id = None
     
     # Non-admin users can only view their own branch
     if user['role'] in [UserRole.PHARMACIST.value, UserRole.WHOLESALER.value]:
         query = query.filter(Branch.id == user['branch_id'])
+        scope_branch_id = user['branch_id']
     
+    # Stamp low_stock_since up front so the flag below is a plain column read
+    BranchProduct.sync_low_stock_since(db, scope_branch_id)
+
     branches = query.all()
-    
-    for branch in branches:
-        # Get branch products that are available with their batches
-        branch_products = (
-            db.query(BranchProduct)
-            .options(joinedload(BranchProduct.batches))
-            .filter(
-                BranchProduct.branch_id == branch.id,
-                BranchProduct.is_available == True
-            )
-            .all()
+
+    # Both status flags for every visible branch in one grouped query. Only
+    # active batches near or past expiry (30 days threshold) survive the join
+    thirty_days_from_now = datetime.now().date() + timedelta(days=30)
+    status_rows = (
+        db.query(
+            BranchProduct.branch_id,
+            sa.func.bool_or(BranchProduct.low_stock_since.isnot(None)).label('has_low_stock'),
+            sa.func.bool_or(ProductBatch.id.isnot(None)).label('has_near_expiry')
         )
-        
-        # Check for low stock
-        has_low_stock = any(bp.is_low_stock for bp in branch_products)
-        
-        # Check for near expiry or expired (30 days threshold)
-        thirty_days_from_now = datetime.now().date() + timedelta(days=30)
-        today = datetime.now().date()
-        
-        has_near_expiry = any(
-            any(
-                batch.is_active and (
-                    batch.expiration_date <= thirty_days_from_now or  # Near expiry
-                    batch.expiration_date <= today  # Already expired
-                )
-                for batch in bp.batches
-            )
-            for bp in branch_products
+        .outerjoin(ProductBatch, sa.and_(
+            ProductBatch.branch_id == BranchProduct.branch_id,
+            ProductBatch.product_id == BranchProduct.product_id,
+            ProductBatch.is_active == True,
+            ProductBatch.expiration_date <= thirty_days_from_now
+        ))
+        .filter(
+            BranchProduct.branch_id.in_([branch.id for branch in branches]),
+            BranchProduct.is_available == True
         )
-        
-        branch.has_low_stock = has_low_stock
-        branch.has_near_expiry = has_near_expiry
+        .group_by(BranchProduct.branch_id)
+        .all()
+    )
+    statuses = {row.branch_id: row for row in status_rows}
+
+    for branch in branches:
+        row = statuses.get(branch.id)
+        branch.has_low_stock = bool(row and row.has_low_stock)
+        branch.has_near_expiry = bool(row and row.has_near_expiry)
     
     return branches
 
@@ -129,9 +133,16 @@ def get_branch(
             detail="You can only view your assigned branch"
         )
     
-    # Get branch products
+    BranchProduct.sync_low_stock_since(db, branch_id)
+
+    # Get branch products with the batches the expiry check reads; any other
+    # lazy load raises instead of quietly issuing a query per row
     branch_products = (
         db.query(BranchProduct)
+        .options(
+            selectinload(BranchProduct.batches),
+            raiseload('*')
+        )
         .filter(
             BranchProduct.branch_id == branch_id,
             BranchProduct.is_available == True
@@ -140,7 +151,7 @@ def get_branch(
     )
 
     # Check for low stock and near expiry using branch products
-    has_low_stock = any(bp.is_low_stock for bp in branch_products)
+    has_low_stock = any(bp.low_stock_since is not None for bp in branch_products)
     has_near_expiry = any(
         bp.current_expiration_date 
         and bp.current_expiration_date <= datetime.now().date() + timedelta(days=30)
@@ -168,6 +179,9 @@ def update_branch(
         setattr(db_branch, key, value)
     
     db.commit()
+    # Branch type and active flag feed cached branch product and overview responses
+    branch_product_cache.clear()
+    response_cache.clear()
     db.refresh(db_branch)
     return db_branch
 
@@ -182,4 +196,6 @@ def delete_branch(
         raise HTTPException(status_code=404, detail="Branch not found")
     db.delete(branch)
     db.commit()
+    branch_product_cache.clear()
+    response_cache.clear()
     return {"detail": "Branch deleted successfully"}
\ No newline at end of file
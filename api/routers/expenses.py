@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import func
 from typing import List, Optional, Annotated
 from pydantic import BaseModel, Field, computed_field
 from datetime import date, datetime, timedelta
 
-from api.models import Expense, ExpenseScope, ExpenseType, Branch, UserRole, AnalyticsTimeSeries
+from api.models import Expense, ExpenseScope, ExpenseType, Branch, UserRole, AnalyticsTimeSeries, MonthlyBranchMetric
 from api.deps import db_dependency, role_required
+from api.cache import period_cache, response_cache
 
 router = APIRouter(
     prefix='/expenses',
@@ -76,6 +78,9 @@ def create_expense(
     db.add(db_expense)
     db.commit()
     db.refresh(db_expense)
+    MonthlyBranchMetric.invalidate(db, db_expense.date_created)
+    period_cache.clear()
+    response_cache.clear()
 
     # Record the expense metric
     AnalyticsTimeSeries.record_metric(
@@ -125,39 +130,42 @@ def get_expense_analytics(
     start_date = today - timedelta(days=days)
     last_month_start = today - timedelta(days=days*2)
     
-    query = db.query(Expense)
+    filters = [Expense.date_created >= last_month_start]
     if current_user['role'] != UserRole.ADMIN.value:
         branch_id = current_user['branch_id']
-        query = query.filter(Expense.branch_id == branch_id)
+        filters.append(Expense.branch_id == branch_id)
     elif branch_id:
-        query = query.filter(Expense.branch_id == branch_id)
+        filters.append(Expense.branch_id == branch_id)
 
-    current_expenses = query.filter(Expense.date_created >= start_date).all()
-    last_month_expenses = query.filter(
-        Expense.date_created >= last_month_start,
-        Expense.date_created < start_date
-    ).all()
+    # Both periods per category in one grouped scan instead of loading every expense
+    is_current = Expense.date_created >= start_date
+    category_rows = db.query(
+        Expense.type,
+        func.sum(Expense.amount).filter(is_current).label('current_amount'),
+        func.sum(Expense.amount).filter(~is_current).label('previous_amount'),
+        func.max(Expense.created_at).filter(is_current).label('last_created_at')
+    ).filter(*filters).group_by(Expense.type).all()
 
     # Calculate analytics
-    current_total = sum(expense.amount for expense in current_expenses)
-    last_month_total = sum(expense.amount for expense in last_month_expenses)
+    category_totals = {
+        row.type: row.current_amount
+        for row in category_rows
+        if row.current_amount is not None
+    }
+    current_total = sum(category_totals.values())
+    last_month_total = sum(row.previous_amount or 0 for row in category_rows)
     
     month_over_month = ((current_total - last_month_total) / last_month_total * 100 
                        if last_month_total > 0 else 0)
     
-    category_totals = {}
-    for expense in current_expenses:
-        category_totals[expense.type] = category_totals.get(expense.type, 0) + expense.amount
-    
     highest_category = max(category_totals.items(), key=lambda x: x[1]) if category_totals else ("None", 0)
     highest_category_percentage = (highest_category[1] / current_total * 100 
                                  if current_total > 0 else 0)
 
-    # Get latest expense details
-    latest_expense = (
-        query.filter(Expense.date_created >= start_date)
-        .order_by(Expense.created_at.desc())
-        .first()
+    # Latest expense timestamp in the current period
+    last_created_at = max(
+        (row.last_created_at for row in category_rows if row.last_created_at is not None),
+        default=None
     )
 
     return {
@@ -166,7 +174,7 @@ def get_expense_analytics(
         "highest_category": highest_category[0],
         "highest_category_percentage": highest_category_percentage,
         "month_over_month_change": month_over_month,
-        "last_expense_date": latest_expense.created_at if latest_expense else datetime.now(),
+        "last_expense_date": last_created_at or datetime.now(),
         "category_distribution": [
             {"category": cat, "amount": amt} 
             for cat, amt in category_totals.items()
@@ -210,11 +218,16 @@ def update_expense(
             detail="You can only update expenses from your branch"
         )
     
+    previous_date = expense.date_created
     for key, value in expense_update.model_dump(exclude_unset=True).items():
         setattr(expense, key, value)
     
     db.commit()
     db.refresh(expense)
+    MonthlyBranchMetric.invalidate(db, previous_date)
+    MonthlyBranchMetric.invalidate(db, expense.date_created)
+    period_cache.clear()
+    response_cache.clear()
     return expense
 
 @router.delete("/{expense_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -234,5 +247,9 @@ def delete_expense(
             detail="You can only delete expenses from your branch"
         )
     
+    expense_date = expense.date_created
     db.delete(expense)
-    db.commit() 
\ No newline at end of file
+    db.commit() 
+    MonthlyBranchMetric.invalidate(db, expense_date)
+    period_cache.clear()
+    response_cache.clear()
\ No newline at end of file
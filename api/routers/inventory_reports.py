@@ -1,18 +1,24 @@
+import logging
+
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.exc import SQLAlchemyError
 import sqlalchemy as sa
 from typing import List, Optional, Annotated
 from pydantic import BaseModel, computed_field
 from datetime import date, datetime, timedelta
 
-from api.models import Branch, InvReport, InvReportItem, BranchProduct, Product, UserRole, ProductBatch, InvReportBatch, AnalyticsTimeSeries
+from api.models import Branch, InvReport, InvReportItem, BranchProduct, Product, UserRole, ProductBatch, InvReportBatch, AnalyticsTimeSeries, DailyBranchMetric
 from api.deps import db_dependency, role_required
+from api.cache import response_cache, branch_product_cache
 
 router = APIRouter(
     prefix='/inventory-reports',
     tags=['inventory reports']
 )
 
+logger = logging.getLogger(__name__)
+
 class BatchDeliveryInfo(BaseModel):
     quantity: int
     expiration_date: date
@@ -306,15 +312,12 @@ def update_branch_product_quantity(db: Session, branch_id: int, product_id: int)
         db.commit()
         return
 
-    total_quantity = db.query(sa.func.sum(ProductBatch.quantity))\
-        .filter(
-            ProductBatch.branch_id == branch_id,
-            ProductBatch.product_id == product_id,
-            ProductBatch.is_active == True
-        ).scalar() or 0
-    
     old_quantity = branch_product.quantity
-    branch_product.quantity = total_quantity
+    # quantity is maintained by the product_batches trigger; flush the pending
+    # batch changes so it fires, then read the result back
+    db.flush()
+    db.refresh(branch_product, attribute_names=['quantity'])
+    total_quantity = branch_product.quantity or 0
     
     # Check for low stock status
     threshold = (
@@ -495,6 +498,19 @@ def create_inventory_report(
                 product_id=item.product_id,
                 branch_id=complete_report.branch_id
             )
+
+    # Keep the daily sales rollup in step with the new report. The report is
+    # already committed, so a failed refresh is logged rather than failing the
+    # request; the refresh_metrics cron rebuilds the row later
+    try:
+        DailyBranchMetric.refresh(db, complete_report.branch_id, complete_report.end_date.date())
+    except SQLAlchemyError:
+        db.rollback()
+        logger.exception(
+            "Failed to refresh daily metrics for branch %s", complete_report.branch_id
+        )
+    response_cache.clear()
+    branch_product_cache.clear()
     
     return complete_report
 
@@ -7,6 +7,7 @@ from uuid import uuid4
 
 from api.models import Product, UserRole, Branch, BranchProduct, PriceHistory
 from api.deps import db_dependency, user_dependency, role_required
+from api.cache import branch_product_cache
 
 router = APIRouter(
     prefix='/products',
@@ -95,6 +96,7 @@ def add_product(
     
     try:
         db.commit()
+        branch_product_cache.clear()
         db.refresh(db_product)
         return db_product
     except Exception as e:
@@ -144,6 +146,7 @@ def update_product(
         setattr(db_product, key, value)
     
     db.commit()
+    branch_product_cache.clear()
     db.refresh(db_product)
     return db_product
 
@@ -188,6 +191,7 @@ def delete_product(
     
     try:
         db.commit()
+        branch_product_cache.clear()
         return {"detail": "Product deleted successfully"}
     except Exception as e:
         db.rollback()
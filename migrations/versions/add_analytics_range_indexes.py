@@ -0,0 +1,77 @@
+"""add composite indexes for analytics date range scans
+
+Revision ID: add_analytics_range_indexes
+Revises: add_monthly_branch_metrics
+Create Date: 2026-10-16 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_analytics_range_indexes'
+down_revision: Union[str, None] = 'add_monthly_branch_metrics'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_invreports_branch_end_date',
+            'invreports',
+            ['branch_id', 'end_date'],
+            unique=False,
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+        op.create_index(
+            'ix_expenses_branch_date',
+            'expenses',
+            ['branch_id', 'date_created'],
+            unique=False,
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+        op.create_index(
+            'ix_product_batches_active_expiry',
+            'product_batches',
+            ['expiration_date'],
+            unique=False,
+            postgresql_include=['branch_id', 'product_id'],
+            postgresql_where=sa.text('is_active AND quantity > 0'),
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+
+        # Widen the item covering index so the top-products grouping is index-only too
+        op.drop_index('ix_invreport_items_report_totals', table_name='invreport_items', postgresql_concurrently=True, if_exists=True)
+        op.create_index(
+            'ix_invreport_items_report_totals',
+            'invreport_items',
+            ['invreport_id'],
+            unique=False,
+            postgresql_include=['product_id', 'offtake', 'current_srp', 'current_cost'],
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_invreport_items_report_totals', table_name='invreport_items', postgresql_concurrently=True, if_exists=True)
+        op.create_index(
+            'ix_invreport_items_report_totals',
+            'invreport_items',
+            ['invreport_id'],
+            unique=False,
+            postgresql_include=['offtake', 'current_srp', 'current_cost'],
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+        op.drop_index('ix_product_batches_active_expiry', table_name='product_batches', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_expenses_branch_date', table_name='expenses', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_invreports_branch_end_date', table_name='invreports', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,29 @@
+"""make app version codes and names unique
+
+Revision ID: add_app_version_unique_constraints
+Revises: add_branch_product_quantity_trigger
+Create Date: 2026-10-16 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_app_version_unique_constraints'
+down_revision: Union[str, None] = 'add_branch_product_quantity_trigger'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # upload_apk relies on these to reject duplicates instead of checking first
+    op.create_unique_constraint('app_versions_version_code_key', 'app_versions', ['version_code'])
+    op.create_unique_constraint('app_versions_version_name_key', 'app_versions', ['version_name'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('app_versions_version_name_key', 'app_versions', type_='unique')
+    op.drop_constraint('app_versions_version_code_key', 'app_versions', type_='unique')
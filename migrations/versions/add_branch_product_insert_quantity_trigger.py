@@ -0,0 +1,50 @@
+"""fill branch_products.quantity from active batches on insert
+
+Revision ID: add_branch_product_insert_quantity_trigger
+Revises: add_branch_products_branch_index
+Create Date: 2026-10-16 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_branch_product_insert_quantity_trigger'
+down_revision: Union[str, None] = 'add_branch_products_branch_index'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # product_batches_sync_quantity only fires on batch writes, so a branch
+    # product re-created over existing batches would otherwise keep whatever
+    # quantity the insert supplied
+    op.execute("""
+        CREATE OR REPLACE FUNCTION init_branch_product_quantity() RETURNS trigger AS $$
+        BEGIN
+            NEW.quantity := COALESCE((
+                SELECT SUM(pb.quantity)
+                FROM product_batches pb
+                WHERE pb.branch_id = NEW.branch_id
+                  AND pb.product_id = NEW.product_id
+                  AND pb.is_active
+            ), 0);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+
+    op.execute("DROP TRIGGER IF EXISTS branch_products_init_quantity ON branch_products")
+    op.execute("""
+        CREATE TRIGGER branch_products_init_quantity
+        BEFORE INSERT ON branch_products
+        FOR EACH ROW EXECUTE FUNCTION init_branch_product_quantity()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS branch_products_init_quantity ON branch_products")
+    op.execute("DROP FUNCTION IF EXISTS init_branch_product_quantity()")
@@ -0,0 +1,84 @@
+"""keep branch_products.quantity in sync with active batches via trigger
+
+Revision ID: add_branch_product_quantity_trigger
+Revises: add_analytics_range_indexes
+Create Date: 2026-10-16 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_branch_product_quantity_trigger'
+down_revision: Union[str, None] = 'add_analytics_range_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE OR REPLACE FUNCTION sync_branch_product_quantity() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE branch_products bp
+                SET quantity = COALESCE((
+                    SELECT SUM(pb.quantity)
+                    FROM product_batches pb
+                    WHERE pb.branch_id = OLD.branch_id
+                      AND pb.product_id = OLD.product_id
+                      AND pb.is_active
+                ), 0)
+                WHERE bp.branch_id = OLD.branch_id
+                  AND bp.product_id = OLD.product_id;
+            END IF;
+
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE branch_products bp
+                SET quantity = COALESCE((
+                    SELECT SUM(pb.quantity)
+                    FROM product_batches pb
+                    WHERE pb.branch_id = NEW.branch_id
+                      AND pb.product_id = NEW.product_id
+                      AND pb.is_active
+                ), 0)
+                WHERE bp.branch_id = NEW.branch_id
+                  AND bp.product_id = NEW.product_id;
+            END IF;
+
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+
+    op.execute("DROP TRIGGER IF EXISTS product_batches_sync_quantity ON product_batches")
+    op.execute("""
+        CREATE TRIGGER product_batches_sync_quantity
+        AFTER INSERT OR DELETE OR UPDATE OF quantity, is_active, branch_id, product_id
+        ON product_batches
+        FOR EACH ROW EXECUTE FUNCTION sync_branch_product_quantity()
+    """)
+
+    # Bring every existing row in line with its active batches
+    op.execute("""
+        UPDATE branch_products bp
+        SET quantity = COALESCE(totals.quantity, 0)
+        FROM branch_products target
+        LEFT JOIN (
+            SELECT branch_id, product_id, SUM(quantity) AS quantity
+            FROM product_batches
+            WHERE is_active
+            GROUP BY branch_id, product_id
+        ) totals ON totals.branch_id = target.branch_id
+                AND totals.product_id = target.product_id
+        WHERE bp.branch_id = target.branch_id
+          AND bp.product_id = target.product_id
+          AND bp.quantity IS DISTINCT FROM COALESCE(totals.quantity, 0)
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS product_batches_sync_quantity ON product_batches")
+    op.execute("DROP FUNCTION IF EXISTS sync_branch_product_quantity()")
@@ -0,0 +1,32 @@
+"""add branch_id index on branch products
+
+Revision ID: add_branch_products_branch_index
+Revises: add_app_version_unique_constraints
+Create Date: 2026-10-16 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_branch_products_branch_index'
+down_revision: Union[str, None] = 'add_app_version_unique_constraints'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_branch_products_branch',
+        'branch_products',
+        ['branch_id'],
+        unique=False,
+        if_not_exists=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_branch_products_branch', table_name='branch_products', if_exists=True)
@@ -0,0 +1,61 @@
+"""add daily branch metrics rollup table
+
+Revision ID: add_daily_branch_metrics
+Revises: add_product_batch_active_index
+Create Date: 2026-10-16 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_daily_branch_metrics'
+down_revision: Union[str, None] = 'add_product_batch_active_index'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+
+    # The app's create_all may already have created the empty table
+    if not sa.inspect(bind).has_table('daily_branch_metrics'):
+        op.create_table(
+            'daily_branch_metrics',
+            sa.Column('day', sa.Date(), nullable=False),
+            sa.Column('branch_id', sa.Integer(), nullable=False),
+            sa.Column('revenue', sa.Float(), nullable=False),
+            sa.Column('cost', sa.Float(), nullable=False),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.Column('refreshed_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['branch_id'], ['branches.id']),
+            sa.PrimaryKeyConstraint('day', 'branch_id')
+        )
+
+    # Backfill history from existing inventory reports
+    op.execute("""
+        INSERT INTO daily_branch_metrics (day, branch_id, revenue, cost, quantity, refreshed_at)
+        SELECT
+            ir.end_date::date,
+            ir.branch_id,
+            COALESCE(SUM(iri.offtake * iri.current_srp), 0),
+            COALESCE(SUM(iri.offtake * iri.current_cost), 0),
+            COALESCE(SUM(iri.offtake), 0),
+            now()
+        FROM invreports ir
+        JOIN invreport_items iri ON iri.invreport_id = ir.id
+        WHERE ir.end_date IS NOT NULL AND ir.branch_id IS NOT NULL
+        GROUP BY ir.end_date::date, ir.branch_id
+        ON CONFLICT (day, branch_id) DO UPDATE SET
+            revenue = EXCLUDED.revenue,
+            cost = EXCLUDED.cost,
+            quantity = EXCLUDED.quantity,
+            refreshed_at = EXCLUDED.refreshed_at
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('daily_branch_metrics')
@@ -0,0 +1,47 @@
+"""add covering indexes for invreport analytics
+
+Revision ID: add_invreport_covering_indexes
+Revises: add_invreport_created_day_index
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_invreport_covering_indexes'
+down_revision: Union[str, None] = 'add_invreport_created_day_index'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Built concurrently so report submission isn't blocked while they build
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_invreports_branch_created',
+            'invreports',
+            ['branch_id', 'created_at'],
+            unique=False,
+            postgresql_include=['id'],
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+        op.create_index(
+            'ix_invreport_items_report_totals',
+            'invreport_items',
+            ['invreport_id'],
+            unique=False,
+            postgresql_include=['offtake', 'current_srp', 'current_cost'],
+            postgresql_concurrently=True,
+            if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_invreport_items_report_totals', table_name='invreport_items', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_invreports_branch_created', table_name='invreports', postgresql_concurrently=True, if_exists=True)
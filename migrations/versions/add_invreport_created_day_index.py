@@ -0,0 +1,32 @@
+"""add expression index on invreport created day
+
+Revision ID: add_invreport_created_day_index
+Revises: add_daily_branch_metrics
+Create Date: 2026-10-16 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_invreport_created_day_index'
+down_revision: Union[str, None] = 'add_daily_branch_metrics'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_invreports_created_day',
+        'invreports',
+        [sa.text('date(created_at)')],
+        unique=False,
+        if_not_exists=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_invreports_created_day', table_name='invreports', if_exists=True)
@@ -0,0 +1,40 @@
+"""add monthly branch metrics rollup table
+
+Revision ID: add_monthly_branch_metrics
+Revises: add_invreport_covering_indexes
+Create Date: 2026-10-16 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_monthly_branch_metrics'
+down_revision: Union[str, None] = 'add_invreport_covering_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+
+    # The app's create_all may already have created the empty table
+    if not sa.inspect(bind).has_table('monthly_branch_metrics'):
+        op.create_table(
+            'monthly_branch_metrics',
+            sa.Column('month', sa.Date(), nullable=False),
+            sa.Column('branch_id', sa.Integer(), nullable=False),
+            sa.Column('revenue', sa.Float(), nullable=False),
+            sa.Column('expenses', sa.Float(), nullable=False),
+            sa.Column('refreshed_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['branch_id'], ['branches.id']),
+            sa.PrimaryKeyConstraint('month', 'branch_id')
+        )
+    # Closed months are filled in on first read by MonthlyBranchMetric.ensure
+
+
+def downgrade() -> None:
+    op.drop_table('monthly_branch_metrics')
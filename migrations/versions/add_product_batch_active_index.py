@@ -0,0 +1,34 @@
+"""add partial covering index for active product batches
+
+Revision ID: add_product_batch_active_index
+Revises: d6a46584f073
+Create Date: 2026-10-16 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_product_batch_active_index'
+down_revision: Union[str, None] = 'd6a46584f073'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_product_batches_active_totals',
+        'product_batches',
+        ['branch_id', 'product_id'],
+        unique=False,
+        postgresql_include=['quantity'],
+        postgresql_where=sa.text('is_active'),
+        if_not_exists=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_product_batches_active_totals', table_name='product_batches', if_exists=True)